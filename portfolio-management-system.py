@@ -1,28 +1,34 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import asyncio
+import itertools
 import aiohttp
 from aiolimiter import AsyncLimiter
 import aiosqlite
 from tabulate import tabulate
 import time
 from datetime import datetime
+from dateutil import tz
 import logging
 from cachetools import TTLCache
 import os
 from dotenv import load_dotenv
 import sys
-import json
+import orjson
 import math
 from aiohttp_retry import RetryClient, ExponentialRetry
 import yfinance as yf
 import click
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')  # Charts are rendered to PNG off-screen, never shown in a GUI window
+from matplotlib.figure import Figure
+import threading
 from logging.handlers import RotatingFileHandler
 from io import BytesIO
 import base64
 import numpy as np
+import pandas as pd
 from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from a .env file if present
@@ -51,17 +57,197 @@ logger.addHandler(file_handler)
 # Configuration Constants (can be set via environment variables)
 RATE_LIMIT = int(os.getenv('RATE_LIMIT', '10'))  # max requests per second
 CACHE_TTL = int(os.getenv('CACHE_TTL', '3600'))  # cache for 1 hour
-CACHE_MAXSIZE = int(os.getenv('CACHE_MAXSIZE', '100'))
+CACHE_MAXSIZE = int(os.getenv('CACHE_MAXSIZE', '100'))  # target size; shards may hold up to twice this (see CACHE_SHARD_MAXSIZE)
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'positions.db')
 RETRY_TOTAL = int(os.getenv('RETRY_TOTAL', '3'))
 RETRY_BACKOFF_FACTOR = float(os.getenv('RETRY_BACKOFF_FACTOR', '0.5'))
-RETRY_STATUS_CODES = json.loads(os.getenv('RETRY_STATUS_CODES', '[500,502,503,504]'))
+RETRY_STATUS_CODES = orjson.loads(os.getenv('RETRY_STATUS_CODES', '[500,502,503,504]'))
+PERIODS_PER_YEAR = int(os.getenv('PERIODS_PER_YEAR', '252'))  # snapshots per year used to annualize analytics
+
+# Yahoo Finance spark endpoint accepts at most 20 symbols per request
+YAHOO_SPARK_URL = 'https://query1.finance.yahoo.com/v8/finance/spark'
+SPARK_CHUNK_SIZE = 20
+YAHOO_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+# How long the in-memory copy of the stocks table is trusted before it is reloaded
+STOCK_METADATA_TTL = int(os.getenv('STOCK_METADATA_TTL', '86400'))  # revalidate once a day
+
+# Connection pool limits for the shared HTTP session
+HTTP_CONNECTION_LIMIT = int(os.getenv('HTTP_CONNECTION_LIMIT', '256'))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(os.getenv('HTTP_CONNECTION_LIMIT_PER_HOST', '64'))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
 
 # Set up rate limiting
 rate_limiter = AsyncLimiter(max_rate=RATE_LIMIT, time_period=1)
 
-# Set up caching with TTLCache
-cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+# Size of the thread pool for blocking work (yfinance calls, chart rendering), installed as the
+# event loop's default executor at startup so asyncio.to_thread uses it
+THREAD_POOL_WORKERS = int(os.getenv('THREAD_POOL_WORKERS', '16'))
+
+# Set up caching with TTLCache, split into shards
+# Keys are ('stock', ticker) and ('fx', from_currency, to_currency)
+# Checking and registering an in-flight fetch never awaits, so on the event loop thread the inflight map alone
+# coalesces concurrent callers for a key; no lock is needed around it
+CACHE_SHARDS = 16  # power of two, so a key's shard is hash(key) & (CACHE_SHARDS - 1)
+
+class CacheShard:
+    def __init__(self, maxsize: int, ttl: int):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.inflight = {}  # key -> task or future for fetches that are still running
+
+# CACHE_MAXSIZE is the number of entries the cache is sized for, not a hard cap. Keys do not hash evenly, so
+# each shard gets twice its even share as headroom (an exact split would evict from the busier shards well
+# before the cache as a whole is full), and the shards together can hold up to 2 * CACHE_MAXSIZE entries.
+CACHE_SHARD_MAXSIZE = 2 * math.ceil(CACHE_MAXSIZE / CACHE_SHARDS)
+cache_shards = [CacheShard(maxsize=CACHE_SHARD_MAXSIZE, ttl=CACHE_TTL) for _ in range(CACHE_SHARDS)]
+
+def get_cache_shard(key: tuple) -> CacheShard:
+    return cache_shards[hash(key) & (CACHE_SHARDS - 1)]
+
+def cache_get(key: tuple):
+    return get_cache_shard(key).cache.get(key)
+
+def cache_set(key: tuple, value):
+    get_cache_shard(key).cache[key] = value
+
+# Async function returning the cached value for key, or awaiting coro_factory() once on a miss.
+# Concurrent callers for the same key share the in-flight fetch; None results are not cached.
+async def cache_get_or_set(key: tuple, coro_factory):
+    shard = get_cache_shard(key)
+    value = shard.cache.get(key)
+    if value is not None:
+        return value
+    task = shard.inflight.get(key)
+    if task is None:
+        task = shard.inflight[key] = asyncio.ensure_future(coro_factory())
+
+        def store_result(done: asyncio.Future):
+            shard.inflight.pop(key, None)
+            if not done.cancelled() and done.exception() is None and done.result() is not None:
+                shard.cache[key] = done.result()
+
+        task.add_done_callback(store_result)
+    # Shield the shared task so one cancelled caller does not cancel it for the others
+    return await asyncio.shield(task)
+
+# Async function returning {key: value} for keys, running coro_factory(missing_keys) once for the keys that are
+# neither cached nor already being fetched. It must return {key: value}; absent or None values are not cached.
+# Keys fetched elsewhere are awaited, and each key of this batch is registered in-flight so other callers wait on it.
+async def cache_get_or_set_many(keys: List[tuple], coro_factory) -> dict:
+    values, pending, claimed = {}, {}, {}
+    for key in keys:
+        shard = get_cache_shard(key)
+        value = shard.cache.get(key)
+        if value is not None:
+            values[key] = value
+        elif key in shard.inflight:
+            pending[key] = shard.inflight[key]
+        else:
+            claimed[key] = shard.inflight[key] = asyncio.get_running_loop().create_future()
+    batch = None
+    if claimed:
+        batch = asyncio.ensure_future(coro_factory(list(claimed)))
+
+        def settle_claimed(done: asyncio.Future):
+            # Settle every claimed key, even when the batch fails, so no caller waits forever
+            failed = done.cancelled() or done.exception() is not None
+            fetched = {} if failed else done.result()
+            for key, future in claimed.items():
+                shard = get_cache_shard(key)
+                shard.inflight.pop(key, None)
+                value = fetched.get(key)
+                if value is not None:
+                    shard.cache[key] = value
+                future.set_result(value)
+
+        batch.add_done_callback(settle_claimed)
+        pending.update(claimed)
+    if pending:
+        # Shield the shared fetches so one cancelled caller does not cancel them for the others
+        results = await asyncio.gather(*(asyncio.shield(task) for task in pending.values()), return_exceptions=True)
+        for key, value in zip(pending, results):
+            if value is not None and not isinstance(value, BaseException):
+                values[key] = value
+    if batch is not None:
+        batch.result()  # re-raise a failure of this caller's own batch
+    return values
+
+# SQL statements live in module-level constants so every call reuses the same text
+# and hits the connection's prepared-statement cache
+CREATE_STOCKS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS stocks(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ticker TEXT NOT NULL UNIQUE,
+        name TEXT,
+        exchange TEXT,
+        currency TEXT
+    )
+'''
+CREATE_POSITIONS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS positions(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stock_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        usd_price REAL NOT NULL,
+        total_usd_price REAL NOT NULL,
+        percentage REAL NOT NULL,
+        date INTEGER NOT NULL,
+        FOREIGN KEY(stock_id) REFERENCES stocks(id),
+        UNIQUE(stock_id, date)
+    )
+'''
+# Serves the latest-snapshot summary straight from the index; UNIQUE(stock_id, date) already indexes upserts
+CREATE_POSITIONS_DATE_INDEX_SQL = '''
+    CREATE INDEX IF NOT EXISTS idx_positions_date_pct ON positions(date DESC, percentage DESC)
+'''
+CREATE_SNAPSHOTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS portfolio_snapshots(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date INTEGER NOT NULL UNIQUE,
+        total_value REAL NOT NULL
+    )
+'''
+# Missing name/exchange (e.g. from spark quotes) keep the stored values; RETURNING needs SQLite >= 3.35
+UPSERT_STOCK_SQL = '''
+    INSERT INTO stocks (ticker, name, exchange, currency)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(ticker) DO UPDATE SET
+        name=COALESCE(excluded.name, stocks.name),
+        exchange=COALESCE(excluded.exchange, stocks.exchange),
+        currency=excluded.currency
+    RETURNING id
+'''
+UPSERT_POSITION_SQL = '''
+    INSERT INTO positions (stock_id, quantity, usd_price, total_usd_price, percentage, date)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(stock_id, date) DO UPDATE SET
+        quantity=excluded.quantity,
+        usd_price=excluded.usd_price,
+        total_usd_price=excluded.total_usd_price,
+        percentage=excluded.percentage
+'''
+INSERT_SNAPSHOT_SQL = '''
+    INSERT INTO portfolio_snapshots (date, total_value)
+    VALUES (?, ?)
+    ON CONFLICT(date) DO NOTHING
+'''
+SELECT_STOCKS_SQL = '''
+    SELECT ticker, id, name, exchange, currency
+    FROM stocks
+'''
+SELECT_SUMMARY_SQL = '''
+    SELECT stocks.ticker, stocks.exchange, stocks.currency, positions.quantity, positions.usd_price,
+           positions.total_usd_price, positions.percentage, positions.date
+    FROM positions
+    JOIN stocks ON positions.stock_id = stocks.id
+    WHERE positions.date = (SELECT MAX(date) FROM positions)
+    ORDER BY positions.percentage DESC
+'''
+SELECT_SNAPSHOTS_SQL = '''
+    SELECT date, total_value
+    FROM portfolio_snapshots
+    ORDER BY date ASC
+'''
 
 # Define Pydantic models for data validation
 class Stock(BaseModel):
@@ -89,7 +275,10 @@ class Portfolio(BaseModel):
     positions: List[Position]
 
     def get_total_value(self) -> float:
-        return sum(position.quantity * position.stock.usd_price for position in self.positions if position.stock.usd_price)
+        count = len(self.positions)
+        quantities = np.fromiter((position.quantity for position in self.positions), dtype=np.int64, count=count)
+        prices = np.fromiter((position.stock.usd_price or 0.0 for position in self.positions), dtype=np.float64, count=count)
+        return float(quantities @ prices)
 
 # Response Models
 class AnalyticsReport(BaseModel):
@@ -110,26 +299,61 @@ class SummaryResponse(BaseModel):
 class ReportResponse(BaseModel):
     status: str
 
-# Initialize FastAPI app
+# Initialize FastAPI app; ORJSONResponse is deprecated in recent FastAPI, so orjson is only used for parsing
 app = FastAPI()
 
-# Async function to fetch stock data using yfinance
-async def fetch_stock_data(ticker: str) -> Optional[dict]:
-    loop = asyncio.get_event_loop()
+# The shared connection is opened once under db_open_lock; writers hold db_write_lock for the whole
+# transaction and readers take it too, since on the shared connection they would otherwise see uncommitted rows.
+# Likewise one HTTP session, opened under http_open_lock, is kept for the app's lifetime so keep-alive
+# connections are reused.
+APP_LOCKS = ('db_open_lock', 'db_write_lock', 'http_open_lock')
+
+# Get one of APP_LOCKS from app.state, creating it on first use; locks are never created at import time
+# because before Python 3.10 an asyncio.Lock binds to the loop current at construction, not the one serving requests
+def get_app_lock(name: str) -> asyncio.Lock:
+    lock = getattr(app.state, name, None)
+    if lock is None:
+        lock = asyncio.Lock()
+        setattr(app.state, name, lock)
+    return lock
+
+# Fetch a quote from the yfinance chart metadata (one short daily-history request) instead of the
+# full .info profile; fast_info is avoided since its last_price/exchange load a year of history
+def fetch_fast_quote(symbol: str) -> dict:
+    ticker = yf.Ticker(symbol)
+    metadata = ticker.get_history_metadata()
+    if metadata.get('regularMarketPrice') is None:
+        raise ValueError(f"No market price in history metadata for {symbol}")
+    return {
+        # Yahoo's canonical symbol, so 'aapl' and 'AAPL' map to the same stocks row
+        'symbol': metadata.get('symbol') or ticker.ticker,
+        'longName': metadata.get('longName'),
+        'exchange': metadata.get('exchangeName'),
+        'currency': metadata.get('currency') or 'USD',
+        'regularMarketPrice': metadata.get('regularMarketPrice'),
+    }
+
+# Async function to fetch stock data using yfinance, bypassing the cache
+async def fetch_stock_data_uncached(ticker: str) -> Optional[dict]:
     try:
-        stock = await loop.run_in_executor(None, lambda: yf.Ticker(ticker).info)
+        async with rate_limiter:
+            stock = await asyncio.to_thread(fetch_fast_quote, ticker)
         logger.debug(f"Fetched data for {ticker}: {stock}")
         return stock
     except Exception as e:
         logger.error(f"Error fetching data for {ticker}: {e}")
         return None
 
-# Async function to fetch currency exchange rate using yfinance
-async def fetch_currency_rate(from_currency: str, to_currency: str) -> Optional[float]:
-    loop = asyncio.get_event_loop()
+# Async function to fetch stock data, served from the cache when fresh
+async def fetch_stock_data(ticker: str) -> Optional[dict]:
+    return await cache_get_or_set(('stock', ticker), lambda: fetch_stock_data_uncached(ticker))
+
+# Async function to fetch currency exchange rate using yfinance, bypassing the cache
+async def fetch_currency_rate_uncached(from_currency: str, to_currency: str) -> Optional[float]:
     try:
         currency_pair = f"{from_currency.upper()}{to_currency.upper()}=X"
-        rate_info = await loop.run_in_executor(None, lambda: yf.Ticker(currency_pair).info)
+        async with rate_limiter:
+            rate_info = await asyncio.to_thread(fetch_fast_quote, currency_pair)
         rate = rate_info.get('regularMarketPrice')
         if rate:
             logger.debug(f"Fetched currency rate {from_currency} to {to_currency}: {rate}")
@@ -141,175 +365,373 @@ async def fetch_currency_rate(from_currency: str, to_currency: str) -> Optional[
         logger.error(f"Error fetching currency rate {from_currency} to {to_currency}: {e}")
         return None
 
+# Async function to fetch currency exchange rate, served from the cache when fresh
+async def fetch_currency_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    return await cache_get_or_set(('fx', from_currency, to_currency),
+                                  lambda: fetch_currency_rate_uncached(from_currency, to_currency))
+
+# Parse a spark response into yfinance-style quote dicts keyed by symbol
+def parse_spark_response(payload: dict) -> dict:
+    quotes = {}
+    for result in (payload.get('spark') or {}).get('result') or []:
+        responses = result.get('response') or []
+        if not responses:
+            continue
+        meta = responses[0].get('meta') or {}
+        symbol = meta.get('symbol') or result.get('symbol')
+        if not symbol or meta.get('regularMarketPrice') is None:
+            continue
+        quotes[symbol] = {
+            'symbol': symbol,
+            'longName': meta.get('longName'),
+            'exchange': meta.get('exchangeName'),
+            'currency': meta.get('currency') or 'USD',
+            'regularMarketPrice': meta.get('regularMarketPrice'),
+        }
+    return quotes
+
+# Async function to fetch one chunk of symbols from the spark endpoint
+async def fetch_spark_chunk(client: RetryClient, symbols: List[str]) -> dict:
+    params = {'symbols': ','.join(symbols), 'range': '1d', 'interval': '1d'}
+    try:
+        async with rate_limiter:
+            async with client.get(YAHOO_SPARK_URL, params=params, headers=YAHOO_HEADERS) as response:
+                response.raise_for_status()
+                payload = await response.json(loads=orjson.loads)
+        # Yahoo answers with canonical symbols (e.g. 'AAPL' for 'aapl'); key the quotes by the symbols as requested
+        # so callers find them, while each quote keeps the canonical 'symbol' for the stocks table
+        requested = {symbol.upper(): symbol for symbol in symbols}
+        quotes = {requested.get(symbol.upper(), symbol): quote for symbol, quote in parse_spark_response(payload).items()}
+        logger.debug(f"Fetched spark quotes for {len(quotes)}/{len(symbols)} symbols")
+        return quotes
+    except Exception as e:
+        logger.error(f"Error fetching spark quotes for {','.join(symbols)}: {e}")
+        return {}
+
+# Async function to fetch quotes for many symbols with one request per 20 symbols
+# Misses go through the shared in-flight map, so concurrent updates and per-ticker fetches of the same
+# symbols are coalesced with this batch
+async def fetch_stocks_bulk(client: RetryClient, tickers: List[str]) -> dict:
+    async def fetch_uncached(keys: List[tuple]) -> dict:
+        symbols = [key[1] for key in keys]
+        chunks = [symbols[i:i + SPARK_CHUNK_SIZE] for i in range(0, len(symbols), SPARK_CHUNK_SIZE)]
+        results = await asyncio.gather(*(fetch_spark_chunk(client, chunk) for chunk in chunks))
+        return {('stock', symbol): quote for chunk_quotes in results for symbol, quote in chunk_quotes.items()}
+
+    values = await cache_get_or_set_many([('stock', ticker) for ticker in tickers], fetch_uncached)
+    return {key[1]: quote for key, quote in values.items()}
+
+# Async function to fetch USD conversion rates for several currencies in one batch
+async def fetch_currency_rates_bulk(client: RetryClient, currencies: List[str], to_currency: str = 'USD') -> dict:
+    cached = {currency: cache_get(('fx', currency, to_currency)) for currency in currencies}
+    rates = {currency: rate for currency, rate in cached.items() if rate is not None}
+    pairs = {f"{currency.upper()}{to_currency.upper()}=X": currency for currency in currencies if currency not in rates}
+    quotes = await fetch_stocks_bulk(client, list(pairs))
+    for pair, currency in pairs.items():
+        rate = (quotes.get(pair) or {}).get('regularMarketPrice')
+        if rate:
+            rates[currency] = rate
+            cache_set(('fx', currency, to_currency), rate)
+        else:
+            logger.warning(f"Currency rate {currency} to {to_currency} not found.")
+    return rates
+
 # Async function to initialize the database with stocks, positions, and snapshots tables
 async def init_db(db: aiosqlite.Connection):
-    await db.execute('''
-        CREATE TABLE IF NOT EXISTS stocks(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticker TEXT NOT NULL UNIQUE,
-            name TEXT,
-            exchange TEXT,
-            currency TEXT
-        )
-    ''')
-    await db.execute('''
-        CREATE TABLE IF NOT EXISTS positions(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            stock_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            usd_price REAL NOT NULL,
-            total_usd_price REAL NOT NULL,
-            percentage REAL NOT NULL,
-            date INTEGER NOT NULL,
-            FOREIGN KEY(stock_id) REFERENCES stocks(id),
-            UNIQUE(stock_id, date)
-        )
-    ''')
-    await db.execute('''
-        CREATE TABLE IF NOT EXISTS portfolio_snapshots(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date INTEGER NOT NULL UNIQUE,
-            total_value REAL NOT NULL
-        )
-    ''')
+    # WAL with synchronous=NORMAL keeps commits durable without an fsync per transaction
+    await db.execute('PRAGMA journal_mode=WAL')
+    await db.execute('PRAGMA synchronous=NORMAL')
+    await db.execute(CREATE_STOCKS_TABLE_SQL)
+    await db.execute(CREATE_POSITIONS_TABLE_SQL)
+    await db.execute(CREATE_POSITIONS_DATE_INDEX_SQL)
+    await db.execute(CREATE_SNAPSHOTS_TABLE_SQL)
     await db.commit()
     logger.debug("Initialized the database and ensured the stocks, positions, and portfolio_snapshots tables exist.")
 
+# Async function to open the database connection shared by all requests
+async def open_db() -> aiosqlite.Connection:
+    db = await aiosqlite.connect(DATABASE_PATH)
+    await db.execute('PRAGMA cache_size=-20000')
+    await db.execute('PRAGMA temp_store=MEMORY')
+    await init_db(db)
+    logger.info(f"Opened database connection to {DATABASE_PATH}")
+    return db
+
+# Async function to get the shared connection, opening it on first use outside the app lifecycle
+async def get_db() -> aiosqlite.Connection:
+    async with get_app_lock('db_open_lock'):
+        db = getattr(app.state, 'db', None)
+        if db is None:
+            db = app.state.db = await open_db()
+    return db
+
+# Async function to open the HTTP client shared by all requests
+async def open_http() -> RetryClient:
+    connector = aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT, limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+                                     ttl_dns_cache=HTTP_DNS_CACHE_TTL)
+    retry_options = ExponentialRetry(attempts=RETRY_TOTAL, start_timeout=RETRY_BACKOFF_FACTOR,
+                                     statuses=set(RETRY_STATUS_CODES))
+    return RetryClient(client_session=aiohttp.ClientSession(connector=connector), retry_options=retry_options)
+
+# Async function to get the shared HTTP client, opening it on first use outside the app lifecycle
+async def get_http() -> RetryClient:
+    async with get_app_lock('http_open_lock'):
+        http = getattr(app.state, 'http', None)
+        if http is None:
+            http = app.state.http = await open_http()
+    return http
+
+@app.on_event("startup")
+async def startup():
+    # The loop owns the executor and shuts it down when it closes
+    executor = ThreadPoolExecutor(max_workers=THREAD_POOL_WORKERS, thread_name_prefix='portfolio')
+    asyncio.get_running_loop().set_default_executor(executor)
+    await get_stock_metadata(await get_db())
+    await get_http()
+
+@app.on_event("shutdown")
+async def shutdown():
+    http = getattr(app.state, 'http', None)
+    if http is not None:
+        app.state.http = None
+        await http.close()
+        logger.info("Closed HTTP session.")
+    db = getattr(app.state, 'db', None)
+    if db is not None:
+        app.state.db = None
+        await db.close()
+        logger.info("Closed database connection.")
+    # Locks belong to this loop; a later loop creates its own on first use
+    for name in APP_LOCKS:
+        setattr(app.state, name, None)
+
 # Async function to upsert stocks into the database
-async def upsert_stock(db: aiosqlite.Connection, stock_data: dict) -> Optional[int]:
+# stock_row is (ticker, name, exchange, currency)
+async def upsert_stock(db: aiosqlite.Connection, stock_row: Tuple[str, Optional[str], Optional[str], str]) -> Optional[int]:
+    ticker = stock_row[0]
     try:
-        await db.execute('''
-            INSERT INTO stocks (ticker, name, exchange, currency)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(ticker) DO UPDATE SET
-                name=excluded.name,
-                exchange=excluded.exchange,
-                currency=excluded.currency
-        ''', (
-            stock_data.get('symbol'),
-            stock_data.get('longName'),
-            stock_data.get('exchange'),
-            stock_data.get('currency', 'USD')
-        ))
-        await db.commit()
-        cursor = await db.execute('SELECT id FROM stocks WHERE ticker = ?', (stock_data.get('symbol'),))
+        cursor = await db.execute(UPSERT_STOCK_SQL, stock_row)
         row = await cursor.fetchone()
+        await cursor.close()
         if row:
-            logger.debug(f"Upserted stock {stock_data.get('symbol')} with ID {row[0]}")
+            logger.debug(f"Upserted stock {ticker} with ID {row[0]}")
             return row[0]
     except Exception as e:
-        logger.error(f"Error upserting stock data {stock_data.get('symbol')}: {e}")
+        logger.error(f"Error upserting stock data {ticker}: {e}")
     return None
 
-# Async function to upsert positions into the database
-async def upsert_position(db: aiosqlite.Connection, stock_id: int, quantity: int, usd_price: float, total_usd: float, percentage: float, date: int):
+# Async function to get the in-memory copy of the stocks table, ticker -> (id, name, exchange, currency),
+# reloading it from the database when it is older than STOCK_METADATA_TTL
+async def get_stock_metadata(db: aiosqlite.Connection) -> dict:
+    metadata = getattr(app.state, 'stock_metadata', None)
+    if metadata is None or time.time() - app.state.stock_metadata_loaded_at > STOCK_METADATA_TTL:
+        cursor = await db.execute(SELECT_STOCKS_SQL)
+        rows = await cursor.fetchall()
+        metadata = app.state.stock_metadata = {row[0]: tuple(row[1:]) for row in rows}
+        app.state.stock_metadata_loaded_at = time.time()
+        logger.debug(f"Loaded metadata for {len(metadata)} stocks")
+    return metadata
+
+# Check whether a fetched stock row would change the stored one; missing name/exchange keep the stored values
+def stock_metadata_unchanged(stored: tuple, stock_row: tuple) -> bool:
+    _, name, exchange, currency = stock_row
+    _, stored_name, stored_exchange, stored_currency = stored
+    return ((name is None or name == stored_name)
+            and (exchange is None or exchange == stored_exchange)
+            and currency == stored_currency)
+
+# Async function to upsert a batch of positions into the database
+# Each row is (stock_id, quantity, usd_price, total_usd, percentage, date)
+# Errors propagate so the caller rolls back instead of committing a snapshot without its positions
+async def upsert_positions(db: aiosqlite.Connection, rows: List[tuple]):
     try:
-        await db.execute('''
-            INSERT INTO positions (stock_id, quantity, usd_price, total_usd_price, percentage, date)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(stock_id, date) DO UPDATE SET
-                quantity=excluded.quantity,
-                usd_price=excluded.usd_price,
-                total_usd_price=excluded.total_usd_price,
-                percentage=excluded.percentage
-        ''', (stock_id, quantity, usd_price, total_usd, percentage, date))
-        logger.debug(f"Upserted position for stock_id {stock_id} at date {date}")
+        await db.executemany(UPSERT_POSITION_SQL, rows)
     except Exception as e:
-        logger.error(f"Error upserting position for stock_id {stock_id} at date {date}: {e}")
+        logger.error(f"Error upserting {len(rows)} positions: {e}")
+        raise
+    logger.debug(f"Upserted {len(rows)} positions")
 
 # Async function to update portfolio
 async def update_portfolio(portfolio: Portfolio):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await init_db(db)
-        total_value = portfolio.get_total_value()
-        if total_value == 0:
-            logger.warning("Total portfolio value is zero. Exiting update.")
-            return
-
-        for position in portfolio.positions:
-            # Fetch stock data and upsert
-            stock_info = await fetch_stock_data(position.stock.ticker)
-            if not stock_info:
-                logger.warning(f"Skipping position {position.stock.ticker} due to fetch error.")
-                continue  # Skip if stock data is not available
-            stock = Stock(
-                ticker=stock_info.get('symbol'),
-                name=stock_info.get('longName', ''),
-                exchange=stock_info.get('exchange', ''),
-                currency=stock_info.get('currency', 'USD'),
-                usd_price=stock_info.get('regularMarketPrice', 0.0),
-                timestamp=int(time.time())
-            )
-            stock_id = await upsert_stock(db, stock.dict())
-            if not stock_id:
-                logger.warning(f"Skipping position {position.stock.ticker} due to stock upsert error.")
-                continue  # Skip if stock upsert failed
-
-            # Handle currency conversion
-            if stock.currency != 'USD':
-                conversion_rate = await fetch_currency_rate(stock.currency, 'USD')
-                if not conversion_rate:
-                    logger.warning(f"Skipping position {position.stock.ticker} due to missing currency conversion rate.")
-                    continue  # Skip if conversion rate is unavailable
-                usd_price = stock.usd_price * conversion_rate
-            else:
-                usd_price = stock.usd_price
-
-            total_usd = position.quantity * usd_price
-            percentage = (total_usd / total_value) * 100
-            date = stock.timestamp
-
-            await upsert_position(db, stock_id, position.quantity, usd_price, total_usd, percentage, date)
-
-        # Insert portfolio snapshot
+    db = await get_db()
+    # Cheap check on the client-side prices before any fetching; the stored total comes from fetched prices
+    if portfolio.get_total_value() == 0:
+        logger.warning("Total portfolio value is zero. Exiting update.")
+        return
+
+    # Lots of the same stock are merged so each ticker is fetched and stored once; tickers are normalized
+    # first so 'aapl' and 'AAPL' lots land on the same stock
+    quantity_by_ticker = {}
+    for position in portfolio.positions:
+        ticker = position.stock.ticker.strip().upper()
+        quantity_by_ticker[ticker] = quantity_by_ticker.get(ticker, 0) + position.quantity
+    tickers = list(quantity_by_ticker)
+
+    # Prefetch all quotes and conversion rates in batched requests
+    http = await get_http()
+    quotes = await fetch_stocks_bulk(http, tickers)
+    # Fall back to concurrent per-ticker fetches for symbols the batch did not return
+    missing_tickers = [ticker for ticker in tickers if ticker not in quotes]
+    if missing_tickers:
+        results = await asyncio.gather(*(fetch_stock_data(ticker) for ticker in missing_tickers),
+                                       return_exceptions=True)
+        for ticker, result in zip(missing_tickers, results):
+            if isinstance(result, dict):
+                quotes[ticker] = result
+
+    currencies = list({quote.get('currency') or 'USD' for quote in quotes.values()} - {'USD'})
+    conversion_rates = await fetch_currency_rates_bulk(http, currencies, 'USD')
+    missing_currencies = [currency for currency in currencies if currency not in conversion_rates]
+    if missing_currencies:
+        rates = await asyncio.gather(*(fetch_currency_rate(currency, 'USD') for currency in missing_currencies),
+                                     return_exceptions=True)
+        for currency, rate in zip(missing_currencies, rates):
+            if isinstance(rate, (int, float)) and rate:
+                conversion_rates[currency] = rate
+
+    async with get_app_lock('db_write_lock'):
+        # Write all stocks, positions and the snapshot in a single transaction
+        # One timestamp per update so positions and the snapshot share the same date
+        date = int(time.time())
+        stock_metadata = await get_stock_metadata(db)
+        await db.execute('BEGIN')
         try:
-            await db.execute('''
-                INSERT INTO portfolio_snapshots (date, total_value)
-                VALUES (?, ?)
-                ON CONFLICT(date) DO NOTHING
-            ''', (int(time.time()), total_value))
-            await db.commit()
-            logger.debug(f"Inserted portfolio snapshot: {total_value} at {int(time.time())}")
-        except Exception as e:
-            logger.error(f"Error inserting portfolio snapshot: {e}")
-            raise HTTPException(status_code=500, detail="Failed to create portfolio snapshot")
+            stock_ids, quantities, usd_prices = [], [], []
+            for ticker, quantity in quantity_by_ticker.items():
+                # Look up prefetched stock data and upsert
+                stock_info = quotes.get(ticker)
+                if not stock_info or stock_info.get('regularMarketPrice') is None:
+                    logger.warning(f"Skipping position {ticker} due to fetch error.")
+                    continue  # Skip if stock data is not available
+                # Plain (ticker, name, exchange, currency) row; no model validation on the hot path
+                currency = stock_info.get('currency') or 'USD'
+                stock_row = (stock_info.get('symbol') or ticker, stock_info.get('longName'), stock_info.get('exchange'), currency)
+                # Only write the stock when its metadata changed; otherwise reuse the known id
+                stored = stock_metadata.get(stock_row[0])
+                if stored is not None and stock_metadata_unchanged(stored, stock_row):
+                    stock_id = stored[0]
+                else:
+                    stock_id = await upsert_stock(db, stock_row)
+                    if not stock_id:
+                        logger.warning(f"Skipping position {ticker} due to stock upsert error.")
+                        continue  # Skip if stock upsert failed
+                    stored_name, stored_exchange = (stored[1], stored[2]) if stored is not None else (None, None)
+                    stock_metadata[stock_row[0]] = (stock_id,
+                                                    stock_row[1] if stock_row[1] is not None else stored_name,
+                                                    stock_row[2] if stock_row[2] is not None else stored_exchange,
+                                                    stock_row[3])
+
+                # Handle currency conversion
+                price = stock_info['regularMarketPrice']
+                if currency != 'USD':
+                    conversion_rate = conversion_rates.get(currency)
+                    if not conversion_rate:
+                        logger.warning(f"Skipping position {ticker} due to missing currency conversion rate.")
+                        continue  # Skip if conversion rate is unavailable
+                    usd_price = price * conversion_rate
+                else:
+                    usd_price = price
+
+                stock_ids.append(stock_id)
+                quantities.append(quantity)
+                usd_prices.append(usd_price)
+
+            # Position totals and their share of the portfolio in one vectorized pass
+            totals = np.asarray(quantities, dtype=np.float64) * np.asarray(usd_prices, dtype=np.float64)
+            grand_total = float(totals.sum())
+            if grand_total == 0:
+                # Keep the stock rows written so far, but record no positions or snapshot without priced holdings
+                await db.commit()
+                logger.warning("No priced positions to store. Skipping positions and snapshot.")
+                return
+            percentages = totals / grand_total * 100.0
+
+            # Insert positions and the portfolio snapshot; either failing rolls back the whole update
+            try:
+                await upsert_positions(db, list(zip(stock_ids, quantities, usd_prices, totals.tolist(),
+                                                    percentages.tolist(), itertools.repeat(date))))
+                # The snapshot stores the fetched total the percentages were computed from
+                await db.execute(INSERT_SNAPSHOT_SQL, (date, grand_total))
+                await db.commit()
+                logger.debug(f"Inserted portfolio snapshot: {grand_total} at {date}")
+            except Exception as e:
+                logger.error(f"Error inserting positions and portfolio snapshot: {e}")
+                raise HTTPException(status_code=500, detail="Failed to create portfolio snapshot") from e
+        except BaseException:
+            # Also on cancellation, so the shared connection is never left inside a transaction
+            await db.rollback()
+            app.state.stock_metadata = None  # may hold rows from the rolled-back transaction
+            raise
 
     logger.info("Portfolio update completed.")
 
-# Async function to fetch and display portfolio summary
-async def display_portfolio_summary():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Fetch all positions and related stock info
-        query = '''
-            SELECT stocks.ticker, stocks.exchange, stocks.currency, positions.quantity, positions.usd_price,
-                   positions.total_usd_price, positions.percentage, positions.date
-            FROM positions
-            JOIN stocks ON positions.stock_id = stocks.id
-            ORDER BY positions.percentage DESC
-        '''
-        cursor = await db.execute(query)
+# Off-screen figures reused across renders, one per chart type; plot_lock serializes executor threads
+plot_lock = threading.Lock()
+pie_figure = Figure(figsize=(10, 7))
+pie_ax = pie_figure.add_subplot()
+growth_figure = Figure(figsize=(12, 6))
+growth_ax = growth_figure.add_subplot()
+
+# Encode a figure as a base64 PNG
+def figure_to_base64(figure: Figure) -> str:
+    buf = BytesIO()
+    figure.savefig(buf, format='png')
+    return base64.b64encode(buf.getvalue()).decode()
+
+# Render the portfolio distribution pie chart
+def render_pie(labels: List[str], sizes: List[float]) -> str:
+    with plot_lock:
+        pie_ax.clear()
+        pie_ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140)
+        pie_ax.set_title('Portfolio Distribution')
+        pie_ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+        return figure_to_base64(pie_figure)
+
+# Render the portfolio growth line chart
+def render_growth_chart(dates: List[datetime], values: List[float]) -> str:
+    with plot_lock:
+        growth_ax.clear()
+        growth_ax.plot(dates, values, marker='o', linestyle='-')
+        growth_ax.set_title('Portfolio Growth Over Time')
+        growth_ax.set_xlabel('Date')
+        growth_ax.set_ylabel('Total Portfolio Value (USD)')
+        growth_ax.grid(True)
+        growth_figure.tight_layout()
+        return figure_to_base64(growth_figure)
+
+# Async function to fetch and display portfolio summary, returning the pie chart as a base64 PNG
+async def display_portfolio_summary() -> Optional[str]:
+    db = await get_db()
+    # Fetch the positions of the most recent update and related stock info
+    async with get_app_lock('db_write_lock'):
+        cursor = await db.execute(SELECT_SUMMARY_SQL)
         rows = await cursor.fetchall()
 
-    position_data_display = []
-    for row in rows:
-        ticker, exchange, currency, quantity, usd_price, total_usd, percentage, date = row
-        formatted_time = datetime.fromtimestamp(date).strftime('%Y-%m-%d %H:%M:%S') if date else 'N/A'
-        position_data_display.append([
-            ticker,
-            exchange,
-            currency,
-            quantity,
-            f"{usd_price:.2f}",
-            f"{total_usd:.2f}",
-            f"{percentage:.2f}%",
-            formatted_time
-        ])
+    # Transpose rows into column arrays so formatting and sorting run vectorized
+    columns = list(zip(*rows)) or [()] * 8
+    tickers, exchanges, currencies, quantities = (np.array(column, dtype=object) for column in columns[:4])
+    usd_prices, total_usds, percentages = (np.array(column, dtype=np.float64) for column in columns[4:7])
+    dates = np.array([date or 0 for date in columns[7]], dtype=np.int64)
+
+    # Format timestamps in local time, matching datetime.fromtimestamp; tzlocal() follows DST per timestamp
+    formatted_times = pd.to_datetime(dates, unit='s', utc=True).tz_convert(tz.tzlocal()).strftime('%Y-%m-%d %H:%M:%S')
+    formatted_times = np.where(dates != 0, np.asarray(formatted_times, dtype=object), 'N/A')
 
     # Calculate total portfolio value
-    total_value = sum(float(row[5]) for row in rows)
+    total_value = float(total_usds.sum())
 
     # Sort positions by percentage descending
-    position_data_display.sort(key=lambda x: float(x[6].strip('%')), reverse=True)
+    order = np.argsort(-percentages, kind='stable')
+    position_data_display = list(zip(
+        tickers[order],
+        exchanges[order],
+        currencies[order],
+        quantities[order],
+        np.char.mod('%.2f', usd_prices[order]),
+        np.char.mod('%.2f', total_usds[order]),
+        np.char.add(np.char.mod('%.2f', percentages[order]), '%'),
+        formatted_times[order]
+    ))
 
     # Display the table
     print(tabulate(position_data_display,
@@ -320,32 +742,23 @@ async def display_portfolio_summary():
 
     print(f'\nTotal Portfolio Value: ${total_value:.2f}')
 
-    # Generate a pie chart
+    # Generate a pie chart off the event loop
     if rows:
-        labels = [row[0] for row in rows]
-        sizes = [float(row[5]) for row in rows]
-        plt.figure(figsize=(10, 7))
-        plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140)
-        plt.title('Portfolio Distribution')
-        plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-        plt.show()
+        return await asyncio.to_thread(render_pie, tickers.tolist(), total_usds.tolist())
     else:
         print("No positions to display.")
+        return None
 
-# Async function to generate performance report
-async def generate_performance_report():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        query = '''
-            SELECT date, total_value
-            FROM portfolio_snapshots
-            ORDER BY date ASC
-        '''
-        cursor = await db.execute(query)
+# Async function to generate performance report, returning the growth chart as a base64 PNG
+async def generate_performance_report() -> Optional[str]:
+    db = await get_db()
+    async with get_app_lock('db_write_lock'):
+        cursor = await db.execute(SELECT_SNAPSHOTS_SQL)
         rows = await cursor.fetchall()
 
     if not rows:
         print("No portfolio snapshots available to generate a report.")
-        return
+        return None
 
     dates = [datetime.fromtimestamp(row[0]) for row in rows]
     values = [row[1] for row in rows]
@@ -361,17 +774,47 @@ async def generate_performance_report():
 
     print(tabulate(table_data, headers=['Date', 'Total Portfolio Value'], tablefmt='psql', floatfmt='.2f'))
 
-    # Generate a line chart for portfolio growth over time
-    plt.figure(figsize=(12, 6))
-    plt.plot(dates, values, marker='o', linestyle='-')
-    plt.title('Portfolio Growth Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Total Portfolio Value (USD)')
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    # Generate a line chart for portfolio growth over time off the event loop
+    image = await asyncio.to_thread(render_growth_chart, dates, values)
 
     logger.info("Performance report generated successfully.")
+    return image
+
+# Compute annualized volatility and Sharpe ratio from consecutive portfolio values
+def compute_return_statistics(values: np.ndarray) -> Tuple[Optional[float], Optional[float]]:
+    if values.size < 3:
+        return None, None
+    returns = np.diff(values) / values[:-1]
+    std = returns.std(ddof=1)
+    annualization = np.sqrt(PERIODS_PER_YEAR)
+    volatility = float(std * annualization)
+    sharpe_ratio = float(returns.mean() / std * annualization) if std > 0 else None
+    return volatility, sharpe_ratio
+
+# Async function to generate analytics report from portfolio snapshots
+async def generate_analytics_report() -> str:
+    db = await get_db()
+    async with get_app_lock('db_write_lock'):
+        cursor = await db.execute(SELECT_SNAPSHOTS_SQL)
+        rows = await cursor.fetchall()
+
+    if not rows:
+        return "No portfolio snapshots available to generate analytics."
+
+    values = np.asarray(rows, dtype=np.float64)[:, 1]
+    volatility, sharpe_ratio = compute_return_statistics(values)
+    lines = [
+        f"Total Portfolio Value: ${values[-1]:.2f}",
+        f"Snapshots: {values.size}",
+    ]
+    if volatility is None:
+        lines.append("Not enough snapshots to compute volatility and Sharpe ratio.")
+    else:
+        lines.append(f"Portfolio Volatility (annualized): {volatility:.2%}")
+        sharpe_text = f"{sharpe_ratio:.2f}" if sharpe_ratio is not None else "N/A"
+        lines.append(f"Portfolio Sharpe Ratio (annualized): {sharpe_text}")
+    logger.info("Analytics report generated successfully.")
+    return "\n".join(lines)
 
 # Async function to generate optimization report (Placeholder)
 async def generate_optimization_report():
@@ -1,15 +1,75 @@
-from functools import lru_cache
 import numpy as np
 import pandas as pd
 import talib as ta
-from numba import jit
+from numba import float64, int64, njit
 
-@jit(nopython=True)
-def fast_k(rsi: np.ndarray, low: np.ndarray, high: np.ndarray, n: int) -> np.ndarray:
-    """Calculate fast k stochastic of RSI."""
-    return 100 * (rsi - low) / (high - low)
+# Windows narrower than this are treated as flat and mapped to the midpoint
+FLAT_SPAN_EPS = 1e-12
+# fastmath without nnan/ninf, since NaN marks the RSI warm-up period
+FASTMATH_FLAGS = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+@njit(inline='always')
+def _fast_k_value(rsi: float, low: float, high: float) -> float:
+    """Fast k of a single point, 50 for a flat window and NaN during warm-up."""
+    span = high - low
+    if span > FLAT_SPAN_EPS:
+        return 100.0 * (rsi - low) / span
+    if span == span:
+        return 50.0
+    return np.nan
+
+# No cache=True: this hyphenated file is loaded under arbitrary module names, which numba's cache cannot locate
+@njit(float64[::1](float64[::1], int64), fastmath=FASTMATH_FLAGS, boundscheck=False)
+def rolling_fast_k(rsi: np.ndarray, window: int) -> np.ndarray:
+    """
+    Calculate fast k stochastic of RSI over a rolling window in a single pass.
+
+    The rolling min and max are tracked with monotonic deques of indices held in
+    preallocated arrays, so the whole series costs O(n) regardless of `window`.
+    Windows that are not yet full or contain NaN yield NaN, as pandas rolling does.
+    """
+    n = rsi.shape[0]
+    out = np.full(n, np.nan)
+    min_idx = np.empty(n, dtype=np.int64)
+    max_idx = np.empty(n, dtype=np.int64)
+    min_head = min_tail = max_head = max_tail = 0
+    last_nan = -1
+    for i in range(n):
+        value = rsi[i]
+        if value != value:
+            last_nan = i
+            min_head = min_tail = max_head = max_tail = 0
+            continue
+        while min_tail > min_head and rsi[min_idx[min_tail - 1]] >= value:
+            min_tail -= 1
+        min_idx[min_tail] = i
+        min_tail += 1
+        while max_tail > max_head and rsi[max_idx[max_tail - 1]] <= value:
+            max_tail -= 1
+        max_idx[max_tail] = i
+        max_tail += 1
+        start = i - window + 1
+        while min_idx[min_head] < start:
+            min_head += 1
+        while max_idx[max_head] < start:
+            max_head += 1
+        if start > last_nan:
+            out[i] = _fast_k_value(value, rsi[min_idx[min_head]], rsi[max_idx[max_head]])
+    return out
+
+def sma(values: np.ndarray, window: int) -> np.ndarray:
+    """Simple moving average as a cumulative-sum boxcar, skipping leading NaNs like TA-Lib."""
+    out = np.full(values.shape[0], np.nan)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return out
+    start = int(np.argmax(valid))
+    if values.shape[0] - start < window:
+        return out
+    csum = np.concatenate(([0.0], np.cumsum(values[start:])))
+    out[start + window - 1:] = (csum[window:] - csum[:-window]) / window
+    return out
 
-@lru_cache(maxsize=None)
 def stoch_rsi(close: pd.Series, 
               length: int = 14, 
               k_period: int = 5, 
@@ -33,14 +93,11 @@ def stoch_rsi(close: pd.Series,
     fastk, fastd : tuple[pd.Series, pd.Series]
         The fast %K and %D stochastic series.
     """
-    rsi_ = ta.RSI(close, timeperiod=length)
-    rsi_low = rsi_.rolling(window=length).min()
-    rsi_high = rsi_.rolling(window=length).max()
+    values = np.ascontiguousarray(close.to_numpy(), dtype=np.float64)
+    rsi_ = np.require(ta.RSI(values, timeperiod=length), dtype=np.float64, requirements=['C', 'W'])
 
-    fastk = pd.Series(fast_k(rsi_.values, rsi_low.values, rsi_high.values, len(close)), 
-                      index=close.index)
-    fastk = ta.SMA(fastk, timeperiod=k_period)
+    fastk = sma(rolling_fast_k(rsi_, length), k_period)
     
-    fastd = ta.SMA(fastk, timeperiod=d_period)
+    fastd = sma(fastk, d_period)
     
-    return fastk, fastd
+    return pd.Series(fastk, index=close.index), pd.Series(fastd, index=close.index)
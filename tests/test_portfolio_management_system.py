@@ -0,0 +1,229 @@
+import asyncio
+import importlib.util
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+# portfolio-management-system.py is not importable by name, so load it from its path; it opens
+# portfolio.log in the working directory at import time, so import it from a temporary one
+MODULE_PATH = Path(__file__).resolve().parents[1] / 'portfolio-management-system.py'
+spec = importlib.util.spec_from_file_location('portfolio_management_system', MODULE_PATH)
+pms = importlib.util.module_from_spec(spec)
+cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+try:
+    spec.loader.exec_module(pms)
+finally:
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    """The module with a fresh database, empty caches and Yahoo stubbed out."""
+    monkeypatch.setattr(pms, 'DATABASE_PATH', str(tmp_path / 'positions.db'))
+    for name in ('db', 'http', 'stock_metadata', *pms.APP_LOCKS):
+        setattr(pms.app.state, name, None)
+    for shard in pms.cache_shards:
+        shard.cache.clear()
+        shard.inflight.clear()
+
+    async def fetch_stocks_bulk(client, tickers):
+        return {ticker: {'symbol': ticker.upper(), 'longName': f'{ticker.upper()} Inc.', 'exchange': 'NMS',
+                         'currency': 'USD', 'regularMarketPrice': 10.0} for ticker in tickers}
+
+    async def fetch_uncached(*args):
+        raise AssertionError('unexpected network fetch')
+
+    monkeypatch.setattr(pms, 'fetch_stocks_bulk', fetch_stocks_bulk)
+    monkeypatch.setattr(pms, 'fetch_stock_data_uncached', fetch_uncached)
+    monkeypatch.setattr(pms, 'fetch_currency_rate_uncached', fetch_uncached)
+    return pms
+
+
+def run_app(app, body):
+    """Run body() between the app's startup and shutdown hooks."""
+    async def main():
+        await app.startup()
+        try:
+            return await body()
+        finally:
+            await app.shutdown()
+    return asyncio.run(main())
+
+
+def make_portfolio(app, *lots):
+    return app.Portfolio(name='test', positions=[app.Position(stock=app.Stock(ticker=ticker, usd_price=10.0),
+                                                             quantity=quantity) for ticker, quantity in lots])
+
+
+async def fetch_all(db, sql):
+    cursor = await db.execute(sql)
+    return await cursor.fetchall()
+
+
+class CountingFactory:
+    """Coroutine factory that counts its calls and answers after a short delay."""
+
+    def __init__(self, result=None, error=None):
+        self.calls = []
+        self.result = result
+        self.error = error
+
+    async def __call__(self, *args):
+        self.calls.append(args)
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        if self.result is not None:
+            return self.result
+        return {key: key[1].upper() for key in args[0]}
+
+
+def test_cache_get_or_set_coalesces_concurrent_callers(app):
+    factory = CountingFactory(result='quote')
+
+    async def main():
+        return await asyncio.gather(*(app.cache_get_or_set(('stock', 'coalesce'), factory) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['quote'] * 5
+    assert len(factory.calls) == 1
+    assert app.cache_get(('stock', 'coalesce')) == 'quote'
+
+
+def test_cache_get_or_set_does_not_cache_factory_errors(app):
+    factory = CountingFactory(error=RuntimeError('boom'))
+
+    async def main():
+        return await asyncio.gather(*(app.cache_get_or_set(('stock', 'error'), factory) for _ in range(3)),
+                                    return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(main()))
+    assert len(factory.calls) == 1
+    assert app.cache_get(('stock', 'error')) is None
+    assert not app.get_cache_shard(('stock', 'error')).inflight
+
+
+def test_cache_get_or_set_survives_caller_cancellation(app):
+    factory = CountingFactory(result='quote')
+
+    async def main():
+        first = asyncio.ensure_future(app.cache_get_or_set(('stock', 'cancel'), factory))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(app.cache_get_or_set(('stock', 'cancel'), factory))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == 'quote'
+    assert len(factory.calls) == 1
+
+
+def test_cache_get_or_set_many_coalesces_batches_and_single_fetches(app):
+    factory = CountingFactory()
+    single = CountingFactory(result='SINGLE')
+
+    async def main():
+        return await asyncio.gather(
+            app.cache_get_or_set_many([('stock', 'a'), ('stock', 'b')], factory),
+            app.cache_get_or_set_many([('stock', 'b'), ('stock', 'c')], factory),
+            app.cache_get_or_set(('stock', 'a'), single),
+        )
+
+    first, second, single_result = asyncio.run(main())
+    assert first == {('stock', 'a'): 'A', ('stock', 'b'): 'B'}
+    assert second == {('stock', 'b'): 'B', ('stock', 'c'): 'C'}
+    assert single_result == 'A'
+    assert [call[0] for call in factory.calls] == [[('stock', 'a'), ('stock', 'b')], [('stock', 'c')]]
+    assert not single.calls
+
+
+def test_cache_get_or_set_many_factory_error(app):
+    factory = CountingFactory(error=RuntimeError('boom'))
+
+    async def main():
+        owner = asyncio.ensure_future(app.cache_get_or_set_many([('stock', 'x')], factory))
+        await asyncio.sleep(0)
+        waiter = await app.cache_get_or_set_many([('stock', 'x')], factory)
+        with pytest.raises(RuntimeError):
+            await owner
+        return waiter
+
+    assert asyncio.run(main()) == {}
+    assert len(factory.calls) == 1
+    assert app.cache_get(('stock', 'x')) is None
+    assert not app.get_cache_shard(('stock', 'x')).inflight
+
+
+def test_cache_get_or_set_many_survives_caller_cancellation(app):
+    factory = CountingFactory()
+
+    async def main():
+        owner = asyncio.ensure_future(app.cache_get_or_set_many([('stock', 'y')], factory))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(app.cache_get_or_set_many([('stock', 'y')], factory))
+        await asyncio.sleep(0)
+        owner.cancel()
+        return await waiter
+
+    assert asyncio.run(main()) == {('stock', 'y'): 'Y'}
+    assert len(factory.calls) == 1
+    assert app.cache_get(('stock', 'y')) == 'Y'
+
+
+def test_update_portfolio_rolls_back_failed_positions_upsert(app, monkeypatch):
+    async def failing_upsert_positions(db, rows):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    async def body():
+        db = await app.get_db()
+        with monkeypatch.context() as patch:
+            patch.setattr(app, 'upsert_positions', failing_upsert_positions)
+            with pytest.raises(HTTPException):
+                await app.update_portfolio(make_portfolio(app, ('AAPL', 1)))
+        assert not db.in_transaction
+        assert app.app.state.stock_metadata is None
+        assert await fetch_all(db, 'SELECT * FROM stocks') == []
+        assert await fetch_all(db, 'SELECT * FROM portfolio_snapshots') == []
+        # The connection is usable again
+        await app.update_portfolio(make_portfolio(app, ('AAPL', 1)))
+        return await fetch_all(db, 'SELECT total_value FROM portfolio_snapshots')
+
+    assert run_app(app, body) == [(10.0,)]
+
+
+def test_update_portfolio_skips_upsert_for_unchanged_metadata(app, monkeypatch):
+    upserted = []
+    upsert_stock = app.upsert_stock
+
+    async def spy_upsert_stock(db, stock_row):
+        upserted.append(stock_row[0])
+        return await upsert_stock(db, stock_row)
+
+    monkeypatch.setattr(app, 'upsert_stock', spy_upsert_stock)
+    portfolio = make_portfolio(app, ('AAPL', 1), ('MSFT', 2))
+
+    async def body():
+        await app.update_portfolio(portfolio)
+        first = sorted(upserted)
+        upserted.clear()
+        await app.update_portfolio(portfolio)
+        return first, list(upserted)
+
+    assert run_app(app, body) == (['AAPL', 'MSFT'], [])
+
+
+def test_update_portfolio_merges_tickers_case_insensitively(app):
+    async def body():
+        await app.update_portfolio(make_portfolio(app, ('aapl', 1), (' AAPL ', 2)))
+        db = await app.get_db()
+        stocks = await fetch_all(db, 'SELECT id, ticker FROM stocks')
+        positions = await fetch_all(db, 'SELECT stock_id, quantity, percentage FROM positions')
+        return stocks, positions
+
+    stocks, positions = run_app(app, body)
+    assert stocks == [(1, 'AAPL')]
+    assert positions == [(1, 3, 100.0)]
@@ -0,0 +1,84 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import talib
+
+# stoch-rsi.py is not importable by name, so load it from its path
+MODULE_PATH = Path(__file__).resolve().parents[1] / 'stoch-rsi.py'
+spec = importlib.util.spec_from_file_location('stoch_rsi', MODULE_PATH)
+stoch_rsi = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(stoch_rsi)
+
+
+def reference_fast_k(rsi: np.ndarray, window: int) -> np.ndarray:
+    """Fast k from pandas rolling min/max, 50 for flat windows."""
+    series = pd.Series(rsi)
+    low = series.rolling(window).min().to_numpy()
+    high = series.rolling(window).max().to_numpy()
+    span = high - low
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fast_k = 100.0 * (rsi - low) / span
+    return np.where(span > stoch_rsi.FLAT_SPAN_EPS, fast_k, np.where(np.isnan(span), np.nan, 50.0))
+
+
+def assert_matches_reference(rsi: np.ndarray, window: int):
+    np.testing.assert_allclose(stoch_rsi.rolling_fast_k(rsi, window), reference_fast_k(rsi, window),
+                               rtol=1e-12, atol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize('window', [1, 2, 5, 14])
+def test_rolling_fast_k_matches_pandas(window):
+    rsi = np.random.default_rng(0).uniform(0.0, 100.0, 500)
+    assert_matches_reference(rsi, window)
+
+
+@pytest.mark.parametrize('window', [3, 14])
+def test_rolling_fast_k_nan_gaps(window):
+    rsi = np.random.default_rng(1).uniform(0.0, 100.0, 200)
+    rsi[:13] = np.nan  # RSI warm-up
+    rsi[50] = np.nan
+    rsi[90:95] = np.nan
+    rsi[-1] = np.nan
+    assert_matches_reference(rsi, window)
+
+
+def test_rolling_fast_k_flat_windows():
+    rsi = np.concatenate([np.full(20, 42.0), np.linspace(40.0, 60.0, 10), np.full(20, 60.0)])
+    result = stoch_rsi.rolling_fast_k(rsi, 5)
+    assert np.all(result[4:20] == 50.0)
+    assert np.all(result[-15:] == 50.0)
+    assert_matches_reference(rsi, 5)
+
+
+@pytest.mark.parametrize('size', [0, 1, 4])
+def test_rolling_fast_k_shorter_than_window(size):
+    rsi = np.linspace(10.0, 90.0, size)
+    result = stoch_rsi.rolling_fast_k(rsi, 5)
+    assert result.shape == (size,)
+    assert np.isnan(result).all()
+
+
+@pytest.mark.parametrize('window', [1, 3, 5])
+@pytest.mark.parametrize('leading_nans', [0, 1, 13])
+def test_sma_matches_talib(window, leading_nans):
+    values = np.random.default_rng(2).uniform(0.0, 100.0, 100)
+    values[:leading_nans] = np.nan
+    np.testing.assert_allclose(stoch_rsi.sma(values, window), talib.SMA(values, timeperiod=window),
+                               rtol=1e-10, equal_nan=True)
+
+
+def test_sma_propagates_inner_nan_like_talib():
+    values = np.random.default_rng(3).uniform(0.0, 100.0, 40)
+    values[:4] = np.nan
+    values[20] = np.nan
+    np.testing.assert_allclose(stoch_rsi.sma(values, 3), talib.SMA(values, timeperiod=3), rtol=1e-10, equal_nan=True)
+
+
+@pytest.mark.parametrize('values', [np.array([]), np.full(10, np.nan), np.array([np.nan, np.nan, 1.0, 2.0])])
+def test_sma_without_a_full_window(values):
+    result = stoch_rsi.sma(values, 3)
+    assert result.shape == values.shape
+    assert np.isnan(result).all()